@@ -1,15 +1,42 @@
 import os
+import argparse
+import atexit
 import glob
 import csv
 import re
-from datetime import datetime
+import string
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+from multiprocessing import freeze_support
 try:
     from docx import Document
+    from docx.oxml.ns import nsmap, qn
+    from lxml import etree
     import pdfplumber
+    import pypdfium2 as pdfium
 except ImportError:
-    print("Libraries missing. Install with: pip install python-docx pdfplumber")
+    print("Libraries missing. Install with: pip install python-docx pdfplumber pypdfium2")
     exit()
 
+# Parsing and output constants
+_MARKER = "Index\nNote: The numbers indicate the book number, followed by the page number."
+# Matches "Book#:Page" with flexible spacing at the start of each comma-separated reference
+_REF_RE = re.compile(r"(?:^|,)\s*(\d+)\s*:\s*([^\s,]+)")
+_DOCX_RUN_CONTENT = etree.XPath("./w:r/*|./w:hyperlink/w:r/*", namespaces=nsmap)  # Run children of a paragraph
+_DOCX_TEXT = {qn("w:t"): None, qn("w:tab"): "\t", qn("w:ptab"): "\t", qn("w:cr"): "\n",
+              qn("w:noBreakHyphen"): "-"}  # None: use the element's text
+_DOCX_BR, _DOCX_BR_TYPE = qn("w:br"), qn("w:type")  # Only text-wrapping breaks are newlines
+_LETTERS = frozenset(string.ascii_letters)  # Single-letter section headings
+_EMPTY_CELLS = ("",) * 6  # Book columns of a section heading row
+_CSV_HEADER = ["Subject", "Book 1", "Book 2", "Book 3", "Book 4", "Book 5", "Book 6"]
+
+# File type menu, built once
+_FILE_TYPES = ("docx", "pdf", "txt")
+_FILE_TYPE_MENU = "\nSelect file type or action:\n1. .docx\n2. .pdf\n3. .txt\n4. Quit"
+
 # Directory setup
 desktop = os.path.join(os.path.expanduser("~"), "Desktop")
 base_dir = os.path.join(desktop, "IndexConverter")
@@ -20,13 +47,14 @@ log_file = os.path.join(base_dir, "conversion_log.txt")
 readme_file = os.path.join(base_dir, "README.txt")
 
 # Create directories if they don't exist
-for dir_path in [base_dir, input_dir, completed_dir, csv_dir]:
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
-for file_type in ["docx", "pdf", "txt"]:
-    type_dir = os.path.join(completed_dir, file_type)
-    if not os.path.exists(type_dir):
-        os.makedirs(type_dir)
+for dir_path in [input_dir, csv_dir]:
+    os.makedirs(dir_path, exist_ok=True)
+for file_type in _FILE_TYPES:
+    os.makedirs(os.path.join(completed_dir, file_type), exist_ok=True)
+
+# Log file, kept open for the whole run; flushed before each prompt (see ask) and on exit
+_LOG_FH = open(log_file, "a", encoding="utf-8", buffering=1 << 16)
+atexit.register(_LOG_FH.close)
 
 # Create README if it doesn't exist
 if not os.path.exists(readme_file):
@@ -42,11 +70,12 @@ Index Converter V1.1 Instructions:
 7. For users without Python, download the pre-built bundle from [your source] and unzip to Desktop.
 """)
 
-print("Welcome to Index Converter V1.1!")
-
 # File selection and conversion
+def input_files(file_type):
+    return glob.glob(os.path.join(input_dir, f"*.{file_type}"))
+
 def get_file_choice(file_type):
-    files = glob.glob(os.path.join(input_dir, f"*.{file_type}"))
+    files = input_files(file_type)
     if not files:
         print(f"No .{file_type} files found in {input_dir}")
         return None, None
@@ -55,7 +84,7 @@ def get_file_choice(file_type):
         print(f"{i}. {os.path.basename(f)}")
     print("0. Convert All")
     print("4. Quit")
-    choice = input("Select file number, '0' for all, or '4' to quit: ")
+    choice = ask("Select file number, '0' for all, or '4' to quit: ")
     if choice == "4":
         print("Exiting...")
         log_entry("User quit from file selection")
@@ -73,162 +102,274 @@ def get_file_choice(file_type):
 # Text extraction
 def extract_text(file_path):
     ext = os.path.splitext(file_path)[1].lower().lstrip(".")
-    marker = "Index\nNote: The numbers indicate the book number, followed by the page number."
-    text = ""
+    text = None
     if ext == "docx":
         doc = Document(file_path)
-        full_text = "\n".join([para.text for para in doc.paragraphs])
-        text = full_text.split(marker, 1)[1].strip() if marker in full_text else ""
+        text = text_after_marker(docx_paragraphs(doc), _MARKER)
     elif ext == "pdf":
-        with pdfplumber.open(file_path) as pdf:
-            full_text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-        text = full_text.split(marker, 1)[1].strip() if marker in full_text else ""
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            pages = (page.get_textpage().get_text_range().replace("\r\n", "\n") for page in pdf)
+            text = text_after_marker(pages, _MARKER)
+        finally:
+            pdf.close()
+        if text is None:  # Fall back to pdfplumber's layout engine
+            with pdfplumber.open(file_path) as pdf:
+                text = text_after_marker((page.extract_text() or "" for page in pdf.pages), _MARKER)
     elif ext == "txt":
         with open(file_path, "r", encoding="utf-8") as f:
-            full_text = f.read()
-        text = full_text.split(marker, 1)[1].strip() if marker in full_text else ""
-    return text.splitlines()
+            text = text_after_marker((line.rstrip("\n") for line in f), _MARKER)
+    return text.splitlines() if text and not text.isspace() else []
+
+# Paragraph text straight from the XML, matching python-docx's paragraph.text
+# without building a Paragraph and Run proxy object for every element
+def docx_paragraphs(doc):
+    for p in doc.element.body.iterchildren(qn("w:p")):
+        parts = []
+        for el in _DOCX_RUN_CONTENT(p):
+            if el.tag == _DOCX_BR:
+                if el.get(_DOCX_BR_TYPE, "textWrapping") == "textWrapping":
+                    parts.append("\n")
+            elif el.tag in _DOCX_TEXT:
+                parts.append(_DOCX_TEXT[el.tag] or el.text or "")
+        yield "".join(parts)
 
-# Parse index with regex
+# Join chunks with newlines, keeping only the text after the marker (None if absent).
+# Only a marker-sized window is searched, so earlier chunks are never held or rescanned.
+def text_after_marker(chunks, marker):
+    chunks = iter(chunks)
+    marker_len = len(marker)
+    tail = None
+    for chunk in chunks:
+        window = chunk if tail is None else tail + "\n" + chunk
+        idx = window.find(marker)
+        if idx >= 0:
+            rest = [window[idx + marker_len:]]
+            rest.extend(chunks)
+            return "\n".join(rest)  # Not stripped: parse_index skips blank lines and strips each line
+        tail = window[-(marker_len - 1):]
+    return None
+
+# Parse index with regex; yields CSV rows so they can be written as they are parsed
 def parse_index(lines):
-    data = []
     current_subject = ""
-    book_pages = {i: [] for i in range(1, 7)}
-    ref_pattern = re.compile(r"(\d+)\s*:\s*(\S+)")  # Matches "Book#:Page" with flexible spacing
+    book_pages = [[] for _ in range(6)]  # Books 1-6, cleared in place between subjects
+    letters, find_refs = _LETTERS, _REF_RE.findall  # Local lookups in the per-line loop
     for line in lines:
         line = line.strip()
         if not line:
             continue
-        if len(line) == 1 and line.isalpha():
+        if len(line) == 1 and line in letters:
             if current_subject:
-                data.append([current_subject] + [format_pages(book_pages[i]) for i in range(1, 7)])
-            data.append([line] + [""] * 6)
+                yield (current_subject, *['"' + ", ".join(bp) + '"' if bp else "" for bp in book_pages])
+            yield (line, *_EMPTY_CELLS)
             current_subject = ""
-            book_pages = {i: [] for i in range(1, 7)}
+            for bp in book_pages:
+                bp.clear()
         else:
-            parts = line.split("\t", 1) if "\t" in line else line.split(None, 1)
+            subject, tab, refs_text = line.partition("\t")  # A tab, if present, ends the subject
+            parts = [subject, refs_text] if tab else line.split(None, 1)
+            continued = line[-1] == ","  # Entry carries on to the next line
             if len(parts) > 1:
-                if not current_subject and not line.endswith(","):
+                if not current_subject and not continued:
                     current_subject = parts[0].strip()
-                refs = parts[1].rstrip(",").split(",")
-                for ref in refs:
-                    match = ref_pattern.match(ref.strip())
-                    if match:
-                        book, pages = match.groups()
-                        book = int(book)
-                        if 1 <= book <= 6:  # Ignore invalid book numbers
-                            book_pages[book].append(pages)
-            if not line.endswith(",") and current_subject:
-                data.append([current_subject] + [format_pages(book_pages[i]) for i in range(1, 7)])
+                for book, pages in find_refs(parts[1]):
+                    book = int(book)
+                    if 1 <= book <= 6:  # Ignore invalid book numbers
+                        book_pages[book - 1].append(pages)
+            if not continued and current_subject:
+                yield (current_subject, *['"' + ", ".join(bp) + '"' if bp else "" for bp in book_pages])
                 current_subject = ""
-                book_pages = {i: [] for i in range(1, 7)}
+                for bp in book_pages:
+                    bp.clear()
     if current_subject:
-        data.append([current_subject] + [format_pages(book_pages[i]) for i in range(1, 7)])
-    return data
-
-def format_pages(pages):
-    if not pages:
-        return ""
-    return f'"{", ".join(pages)}"'
+        yield (current_subject, *['"' + ", ".join(bp) + '"' if bp else "" for bp in book_pages])
 
-# Write CSV and log, move file
-def write_csv_and_move(data, input_file):
+# Write CSV
+def write_csv(rows, input_file):
     output_name = os.path.splitext(os.path.basename(input_file))[0] + ".csv"
     output_path = os.path.join(csv_dir, output_name)
+    # 1 MiB buffer; the file is flushed once on close
+    with open(output_path, "w", newline="", encoding="utf-8", buffering=1 << 20) as f:
+        csv.writer(f).writerows(chain([_CSV_HEADER], rows))
+
+# Write CSV and log
+def write_csv_and_log(rows, input_file):
     print("Writing CSV...")
-    with open(output_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(["Subject", "Book 1", "Book 2", "Book 3", "Book 4", "Book 5", "Book 6"])
-        writer.writerows(data)
+    write_csv(rows, input_file)
     log_entry(f"Processed {os.path.basename(input_file)} (V1.1)")
     print("Done! Note: Import .csv files from 'CSV' into Google Sheets and adjust formatting (e.g., 'Wrap Text') as needed.")
 
-    # Offer to move file to Completed
+# Offer to move file to Completed; returns "moved", "ok" or "retry" (left to the caller).
+# move=True/False answers the prompt up front (--move/--no-move).
+def offer_move(input_file, move=None):
     file_type = os.path.splitext(input_file)[1].lstrip(".").lower()
     completed_path = os.path.join(completed_dir, file_type, os.path.basename(input_file))
-    move = input(f"Move {os.path.basename(input_file)} to Completed/{file_type}? (y/n/r for retry): ").lower()
-    if move == 'y':
+    if move is None:
+        move = ask(f"Move {os.path.basename(input_file)} to Completed/{file_type}? (y/n/r for retry): ").lower()
+    if move is True or move == 'y':
         try:
             os.rename(input_file, completed_path)
             log_entry(f"Moved {os.path.basename(input_file)} to Completed/{file_type}")
             print(f"Moved {os.path.basename(input_file)} to Completed/{file_type}")
+            return "moved"
         except Exception as e:
             log_entry(f"Failed to move {os.path.basename(input_file)}: {str(e)}")
             print(f"Failed to move file: {str(e)}")
     elif move == 'r':
-        print("Retrying conversion...")
+        return "retry"
+    return "ok"
+
+# Convert a single file in a worker process; prompts and logging stay on the parent
+def convert_one(file_path, max_attempts=3):
+    err = None
+    lines = None
+    for attempt in range(1, max_attempts + 1):
         try:
-            lines = extract_text(input_file)
+            if not lines:  # Only re-extract if extraction failed or found nothing
+                lines = extract_text(file_path)
             if not lines:
                 raise ValueError("No index data found after marker")
-            parsed_data = parse_index(lines)
-            write_csv_and_move(parsed_data, input_file)
+            write_csv(parse_index(lines), file_path)
+            return file_path, True, None
         except Exception as e:
-            log_entry(f"Retry failed for {os.path.basename(input_file)}: {str(e)}")
-            print(f"Retry failed: {str(e)}")
+            err = f"Attempt {attempt}/{max_attempts}: {str(e)}"
+    return file_path, False, err
 
 def log_entry(message):
-    with open(log_file, "a", encoding="utf-8") as f:
-        timestamp = datetime.now().strftime("%b/%d %H:%M:%S")
-        f.write(f"{timestamp} ----- {message}\n-----\n")
-
-# Main execution
-while True:
-    print("\nSelect file type or action:")
-    print("1. .docx\n2. .pdf\n3. .txt\n4. Quit")
-    choice = input("Enter number (1-3) or '4' to quit: ")
-    if choice == "4":
-        print("Exiting...")
-        log_entry("User quit from file type menu (V1.1)")
-        exit()
-    file_types = {"1": "docx", "2": "pdf", "3": "txt"}
-    file_type = file_types.get(choice)
-    if not file_type:
-        print("Invalid selection. Try again.")
-        log_entry("Invalid file type selection (V1.1)")
-        continue
-
-    files, convert_all = get_file_choice(file_type)
-    if files is None:
-        continue
-
-    if convert_all:
-        for file in files:
-            attempt = 0
-            max_attempts = 3
-            while attempt < max_attempts:
-                try:
-                    lines = extract_text(file)
-                    if not lines:
-                        raise ValueError("No index data found after marker")
-                    parsed_data = parse_index(lines)
-                    write_csv_and_move(parsed_data, file)
-                    break
-                except Exception as e:
-                    attempt += 1
-                    log_entry(f"Attempt {attempt}/{max_attempts} failed for {os.path.basename(file)}: {str(e)}")
-                    print(f"Error processing {os.path.basename(file)} (Attempt {attempt}/{max_attempts}): {str(e)}")
-                    if attempt == max_attempts:
-                        print(f"Max retries reached for {os.path.basename(file)}. Skipping.")
-                        break
-    else:
+    timestamp = time.strftime("%b/%d %H:%M:%S")
+    _LOG_FH.write(f"{timestamp} ----- {message}\n-----\n")
+
+# Prompt the user; the log is flushed first, since closing the console window
+# while it waits at a prompt ends the program without running atexit
+def ask(prompt):
+    _LOG_FH.flush()
+    return input(prompt)
+
+# Convert several files in parallel, then offer to move each one; True if all converted
+def convert_files(files, move=None):
+    print(f"Converting {len(files)} files...")
+    converted = []
+    finished = 0
+    try:
+        with ProcessPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1)) as ex:
+            for file, ok, err in ex.map(convert_one, files):
+                finished += 1
+                if ok:
+                    log_entry(f"Processed {os.path.basename(file)} (V1.1)")
+                    print(f"Converted {os.path.basename(file)}")
+                    converted.append(file)
+                else:
+                    log_entry(f"Max retries reached for {os.path.basename(file)}. {err}")
+                    print(f"Error processing {os.path.basename(file)} ({err}). Skipping.")
+    except BrokenProcessPool as e:
+        # A worker died (e.g. a crash in a PDF library); results come back in order,
+        # so everything from the first missing result on is unaccounted for
+        for file in files[finished:]:
+            log_entry(f"Not converted {os.path.basename(file)}: worker process stopped ({str(e)})")
+            print(f"Error processing {os.path.basename(file)} (worker process stopped). Skipping.")
+    all_ok = len(converted) == len(files)
+    print("Done! Note: Import .csv files from 'CSV' into Google Sheets and adjust formatting (e.g., 'Wrap Text') as needed.")
+    # Prompt on the main process only, once all workers are finished
+    for file in converted:
+        while offer_move(file, move) == "retry":
+            print("Retrying conversion...")
+            file, ok, err = convert_one(file)
+            if not ok:
+                log_entry(f"Retry failed for {os.path.basename(file)}: {err}")
+                print(f"Retry failed: {err}")
+                all_ok = False
+                break
+            log_entry(f"Processed {os.path.basename(file)} (V1.1)")
+            print(f"Converted {os.path.basename(file)}")
+    return all_ok
+
+# Convert one file on the main process; retries are prompted unless move is preset.
+# Returns True if the file converted.
+def convert_file(file, move=None):
+    attempt = 0
+    max_attempts = 3
+    lines = None
+    while attempt < max_attempts:
         try:
-            lines = extract_text(files[0])
+            if not lines:  # Only re-extract if extraction failed or found nothing
+                lines = extract_text(file)
             if not lines:
                 raise ValueError("No index data found after marker")
-            parsed_data = parse_index(lines)
-            write_csv_and_move(parsed_data, files[0])
+            write_csv_and_log(parse_index(lines), file)
         except Exception as e:
-            log_entry(f"Error processing {os.path.basename(files[0])}: {str(e)}")
-            print(f"Error processing {os.path.basename(files[0])}: {str(e)}")
-            retry = input("Retry conversion? (y/n): ").lower()
-            if retry == 'y':
-                try:
-                    lines = extract_text(files[0])
-                    if not lines:
-                        raise ValueError("No index data found after marker")
-                    parsed_data = parse_index(lines)
-                    write_csv_and_move(parsed_data, files[0])
-                except Exception as e:
-                    log_entry(f"Retry failed for {os.path.basename(files[0])}: {str(e)}")
-                    print(f"Retry failed: {str(e)}")
\ No newline at end of file
+            attempt += 1
+            log_entry(f"Attempt {attempt}/{max_attempts} failed for {os.path.basename(file)}: {str(e)}")
+            print(f"Error processing {os.path.basename(file)} (Attempt {attempt}/{max_attempts}): {str(e)}")
+            if attempt == max_attempts:
+                print(f"Max retries reached for {os.path.basename(file)}.")
+            elif move is None and ask("Retry conversion? (y/n): ").lower() != 'y':
+                break
+            continue
+        # Outside the try: the prompt is not part of the conversion attempt
+        if offer_move(file, move) != "retry":
+            return True
+        print("Retrying conversion...")  # Asked for at the move prompt; not a failed attempt
+        lines = None  # Re-read the file, as convert_files does; the cache only covers failed attempts
+    return False
+
+# Interactive menu
+def run_menu():
+    while True:
+        print(_FILE_TYPE_MENU)
+        choice = ask("Enter number (1-3) or '4' to quit: ")
+        if choice == "4":
+            print("Exiting...")
+            log_entry("User quit from file type menu (V1.1)")
+            exit()
+        file_type = _FILE_TYPES[int(choice) - 1] if choice in ("1", "2", "3") else None
+        if not file_type:
+            print("Invalid selection. Try again.")
+            log_entry("Invalid file type selection (V1.1)")
+            continue
+
+        files, convert_all = get_file_choice(file_type)
+        if files is None:
+            continue
+
+        if convert_all:
+            convert_files(files)
+        else:
+            convert_file(files[0])
+
+# Main execution; with no arguments the interactive menu runs.
+# Scripted runs exit with 1 if any file fails to convert.
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Convert index files in the Input folder to CSV.")
+    ap.add_argument("--type", choices=_FILE_TYPES, help="file type to convert")
+    which = ap.add_mutually_exclusive_group()
+    which.add_argument("--file-index", type=int, metavar="N", help="convert the Nth file of that type (1-N)")
+    which.add_argument("--all", action="store_true", help="convert every file of that type")
+    ap.add_argument("--move", action=argparse.BooleanOptionalAction,
+                    help="move converted files to Completed (default with --type: leave them in Input)")
+    args = ap.parse_args(argv)
+    if args.type is None:
+        if args.all or args.file_index is not None or args.move is not None:
+            ap.error("--type is required with --all, --file-index or --move")
+        print("Welcome to Index Converter V1.1!")
+        run_menu()
+        return
+    if not args.all and args.file_index is None:
+        ap.error("--type needs --all or --file-index")
+    move = bool(args.move)  # Scripted runs never prompt
+
+    files = input_files(args.type)
+    if not files:
+        print(f"No .{args.type} files found in {input_dir}")
+        return 1
+    if args.all:
+        return 0 if convert_files(files, move) else 1
+    elif 1 <= args.file_index <= len(files):
+        return 0 if convert_file(files[args.file_index - 1], move) else 1
+    else:
+        print(f"Invalid file index {args.file_index}: {len(files)} .{args.type} file(s) in {input_dir}")
+        return 1
+
+if __name__ == "__main__":
+    freeze_support()  # Required for the process pool in the PyInstaller build
+    sys.exit(main())